@@ -2,267 +2,370 @@
 
 from __future__ import annotations
 
-import io
 import json
+import os
+import shutil
 import subprocess
-import sys
 from dataclasses import dataclass
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from typing import Any, Callable, NamedTuple
+from unittest.mock import patch
 
 import pytest
 
 import verify_kfp_compiled
+from verify_kfp_compiled import main as _vkc_main
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
 SCRIPT = REPO_ROOT / "verify_kfp_compiled.py"
+_UV = shutil.which("uv")
 
+_DUMMY_PY = "# dummy\n"
+_DEFAULT_YAML = "a: 1\n"
+_DEFAULT_MAP_JSON = json.dumps({"p.py": "p.yaml"})
+_MISSING_PY_MAP_JSON = json.dumps({"missing.py": "out.yaml"})
+_MISSING_YAML_MAP_JSON = json.dumps({"real.py": "missing.yaml"})
 
-@dataclass
-class RunConfig:
-    """Configuration for _run_main function."""
-    extra_args: str = ""
-    monkeypatch: pytest.MonkeyPatch | None = None
-    mock_subprocess_run: MagicMock | None = None
-    modified_only: bool = False
 
+class _FakeCP(NamedTuple):
+    """Minimal stand-in for subprocess.CompletedProcess (the script reads only these)."""
 
-def run_script(*args: str, cwd: Path | None = None) -> subprocess.CompletedProcess:
-    """Run verify_kfp_compiled.py with the given args."""
-    return subprocess.run(
-        [sys.executable, str(SCRIPT), *args],
-        capture_output=True,
-        text=True,
-        cwd=cwd,
-        check=False,
-    )
+    returncode: int
+    stdout: str = ""
+    stderr: str = ""
 
 
-# ----- Subprocess tests (no mocks) -----
+class _RecordingStub:
+    """Lightweight subprocess.run stand-in that records (cmd, kwargs) per call."""
 
+    def __init__(self, fn: Callable[..., Any]) -> None:
+        self.fn = fn
+        self.calls: list[tuple[list[str], dict[str, Any]]] = []
 
-def test_missing_map_file_exits_nonzero(tmp_path: Path) -> None:
-    """When the pipeline map file does not exist, script exits with 1."""
-    result = run_script("--map-file", str(tmp_path / "nonexistent.json"))
-    assert result.returncode == 1
-    assert "Pipeline map file not found" in result.stdout
-    assert "nonexistent.json" in result.stdout
+    def __call__(self, cmd: list[str], **kwargs: Any) -> Any:
+        self.calls.append((cmd, kwargs))
+        return self.fn(cmd, **kwargs)
 
 
-def test_invalid_json_exits_nonzero(tmp_path: Path) -> None:
-    """When the map file contains invalid JSON, script exits with 1."""
-    map_file = tmp_path / "map.json"
-    map_file.write_text("{ invalid }")
-    result = run_script("--map-file", str(map_file))
-    assert result.returncode == 1
-    assert "Invalid JSON" in result.stdout
-    assert "map.json" in result.stdout
+@dataclass
+class RunConfig:
+    """Configuration for _run_main function."""
+    extra_args: str = ""
+    mock_subprocess_run: _RecordingStub | None = None
+    modified_only: bool = False
+    cache_file: str = ""
 
 
-def test_map_file_must_be_json_object(tmp_path: Path) -> None:
-    """When the map file is valid JSON but not an object, script exits with 1."""
-    map_file = tmp_path / "map.json"
-    map_file.write_text("[1, 2, 3]")
-    result = run_script("--map-file", str(map_file))
-    assert result.returncode == 1
-    assert "must be a JSON object" in result.stdout
+def _run_main(
+    map_path: str | None,
+    config: RunConfig | None,
+    capsys: pytest.CaptureFixture[str],
+) -> tuple[int, str]:
+    """Run main() with given argv; return (exit_code, stdout). map_path=None => no args."""
+    if config is None:
+        config = RunConfig()
+
+    argv: list[str] = []
+    if map_path is not None:
+        argv.extend(["--map-file", map_path])
+    if config.extra_args:
+        argv.append(f"--compile-args={config.extra_args}")
+    if config.modified_only:
+        argv.append("--modified-only")
+    if config.cache_file:
+        argv.extend(["--cache-file", config.cache_file])
 
+    # Stubs replace the kfp CLI, so keep main() off the pooled kfp workers.
+    with patch("verify_kfp_compiled._start_kfp_worker", lambda: None):
+        if config.mock_subprocess_run is not None:
+            with patch("verify_kfp_compiled.subprocess.run", config.mock_subprocess_run):
+                code = _vkc_main(argv)
+        else:
+            code = _vkc_main(argv)
 
-def test_map_entries_must_be_strings(tmp_path: Path) -> None:
-    """When the map has non-string key or value, script exits with 1."""
-    map_file = tmp_path / "map.json"
-    map_file.write_text('{"p.py": 123}')
-    result = run_script("--map-file", str(map_file), cwd=tmp_path)
-    assert result.returncode == 1
-    assert "must be strings" in result.stdout or "non-string" in result.stdout
+    return code, capsys.readouterr().out
 
 
-def test_empty_map_exits_zero(tmp_path: Path) -> None:
-    """When the map is an empty object, script exits with 0."""
-    map_file = tmp_path / "map.json"
-    map_file.write_text("{}")
-    result = run_script("--map-file", str(map_file))
-    assert result.returncode == 0
+# ----- CLI tests (in-process, no mocks) -----
 
 
-def test_missing_py_file_exits_nonzero(tmp_path: Path) -> None:
-    """When a mapped .py file does not exist, script exits with 1."""
-    map_file = tmp_path / "map.json"
-    map_file.write_text(json.dumps({"missing.py": "out.yaml"}))
-    (tmp_path / "out.yaml").write_text("existing: yaml\n")
-    result = run_script("--map-file", str(map_file), cwd=tmp_path)
-    assert result.returncode == 1
-    assert "Python file not found" in result.stdout
-    assert "missing.py" in result.stdout
+def _map_writer(
+    content: str, files: dict[str, str] | None = None
+) -> Callable[[Path], str]:
+    """Return a writer that creates map.json (and any files) in a dir; yields its path."""
 
+    def _write(tmp_path: Path) -> str:
+        for name, text in (files or {}).items():
+            (tmp_path / name).write_text(text)
+        map_file = tmp_path / "map.json"
+        map_file.write_text(content)
+        return str(map_file)
 
-def test_missing_yaml_file_exits_nonzero(tmp_path: Path) -> None:
-    """When a mapped .yaml file does not exist, script exits with 1."""
-    map_file = tmp_path / "map.json"
-    (tmp_path / "real.py").write_text("# dummy pipeline\n")
-    map_file.write_text(json.dumps({"real.py": "missing.yaml"}))
-    result = run_script("--map-file", str(map_file), cwd=tmp_path)
-    assert result.returncode == 1
-    assert "Expected YAML missing" in result.stdout
-    assert "missing.yaml" in result.stdout
+    return _write
 
 
-def test_explicit_nonexistent_map_path_exits_nonzero(tmp_path: Path) -> None:
-    """With --map-file pointing to nonexistent path, script exits 1."""
-    result = run_script("--map-file", str(tmp_path / "no-such-map.json"))
-    assert result.returncode == 1
-    assert "no-such-map.json" in result.stdout
+@pytest.mark.parametrize(
+    ("writer", "expected_code", "expected_substrings"),
+    [
+        pytest.param(
+            lambda tmp_path: str(tmp_path / "nonexistent.json"),
+            1,
+            ("Pipeline map file not found", "nonexistent.json"),
+            id="missing-map-file",
+        ),
+        pytest.param(
+            lambda tmp_path: str(tmp_path),
+            1,
+            ("Pipeline map file not found",),
+            id="map-file-is-directory",
+        ),
+        pytest.param(
+            _map_writer("{ invalid }"),
+            1,
+            ("Invalid JSON", "map.json"),
+            id="invalid-json",
+        ),
+        pytest.param(
+            _map_writer("[1, 2, 3]"),
+            1,
+            ("must be a JSON object",),
+            id="map-not-object",
+        ),
+        pytest.param(
+            _map_writer('{"p.py": 123}'),
+            1,
+            ("must be strings",),
+            id="non-string-entry",
+        ),
+        pytest.param(
+            _map_writer(
+                _MISSING_PY_MAP_JSON,
+                {"out.yaml": "existing: yaml\n"},
+            ),
+            1,
+            ("Python file not found", "missing.py"),
+            id="missing-py-file",
+        ),
+        pytest.param(
+            _map_writer(
+                _MISSING_YAML_MAP_JSON,
+                {"real.py": "# dummy pipeline\n"},
+            ),
+            1,
+            ("Expected YAML missing", "missing.yaml"),
+            id="missing-yaml-file",
+        ),
+        pytest.param(
+            lambda tmp_path: str(tmp_path / "no-such-map.json"),
+            1,
+            ("no-such-map.json",),
+            id="explicit-nonexistent-map-path",
+        ),
+        pytest.param(_map_writer("{}"), 0, (), id="empty-map"),
+    ],
+)
+def test_map_file_validation(
+    writer: Callable[[Path], str],
+    expected_code: int,
+    expected_substrings: tuple[str, ...],
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Missing or invalid map files and mapped files exit 1; an empty map exits 0."""
+    monkeypatch.chdir(tmp_path)
+    code, out = _run_main(writer(tmp_path), None, capsys)
+    assert code == expected_code
+    assert all(s in out for s in expected_substrings), out
 
 
-def test_default_map_path_when_no_args(tmp_path: Path) -> None:
+def test_default_map_path_when_no_args(
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
     """With no args, script looks for .github/kfp-pipelines-map.json in cwd."""
     # No map at default path in tmp_path
-    result = run_script(cwd=tmp_path)
-    assert result.returncode == 1
-    assert ".github/kfp-pipelines-map.json" in result.stdout
+    monkeypatch.chdir(tmp_path)
+    code, out = _run_main(None, None, capsys)
+    assert code == 1
+    assert ".github/kfp-pipelines-map.json" in out
+
+
+@pytest.mark.parametrize(
+    ("argv", "expected_code", "expected_substring"),
+    [
+        pytest.param(["--bogus"], 2, "unrecognized arguments: --bogus", id="unknown"),
+        pytest.param(["--map-file"], 2, "expected one argument", id="missing-value"),
+        pytest.param(
+            ["--map-file", "--modified-only"],
+            2,
+            "argument --map-file: expected one argument",
+            id="option-as-value",
+        ),
+        pytest.param(["--modified-only=yes"], 2, "unrecognized", id="flag-with-value"),
+        pytest.param(["--help"], 0, "--compile-args COMPILE_ARGS", id="help"),
+    ],
+)
+def test_argv_usage(
+    argv: list[str],
+    expected_code: int,
+    expected_substring: str,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """Bad options exit 2 with a usage error; --help prints options and exits 0."""
+    with pytest.raises(SystemExit) as excinfo:
+        _vkc_main(argv)
+    assert excinfo.value.code == expected_code
+    captured = capsys.readouterr()
+    assert expected_substring in captured.out + captured.err
 
 
 # ----- In-process tests with mocked subprocess -----
 
 
+_PIPELINE_TEMPLATE = {
+    "p.py": _DUMMY_PY,
+    "p.yaml": _DEFAULT_YAML,
+    "map.json": _DEFAULT_MAP_JSON,
+}
+
+
+@pytest.fixture(scope="session")
+def pipeline_template(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """Write the default p.py, p.yaml, and map.json once per session."""
+    template = tmp_path_factory.mktemp("pipeline-template")
+    for name, content in _PIPELINE_TEMPLATE.items():
+        (template / name).write_text(content)
+    return template
+
+
 def _make_pipeline_map(
     tmp_path: Path,
+    template: Path,
     *,
-    py_content: str = "# dummy\n",
-    yaml_content: str = "a: 1\n",
+    py_content: str = _PIPELINE_TEMPLATE["p.py"],
+    yaml_content: str = _PIPELINE_TEMPLATE["p.yaml"],
 ) -> Path:
-    """Create p.py, p.yaml, and map.json in tmp_path; return path to map.json."""
-    (tmp_path / "p.py").write_text(py_content)
-    (tmp_path / "p.yaml").write_text(yaml_content)
-    map_file = tmp_path / "map.json"
-    map_file.write_text(json.dumps({"p.py": "p.yaml"}))
-    return map_file
+    """Create p.py, p.yaml, and map.json in tmp_path; return path to map.json.
+
+    Files matching the session template are hard-linked from it; only
+    overridden contents are written.
+    """
+    contents = {"p.py": py_content, "p.yaml": yaml_content}
+    for name, default in _PIPELINE_TEMPLATE.items():
+        content = contents.get(name, default)
+        if content == default:
+            os.link(template / name, tmp_path / name)
+        else:
+            (tmp_path / name).write_text(content)
+    return tmp_path / "map.json"
 
 
 def _fake_kfp_run(compiled_content: str):
     """Return a callable that mimics kfp writing compiled_content to --output path."""
 
-    def _run(cmd: list[str], **_kwargs: object) -> subprocess.CompletedProcess:
+    def _run(cmd: list[str], **_kwargs: object) -> _FakeCP:
         out_idx = cmd.index("--output")
         out_path = Path(cmd[out_idx + 1])
         out_path.write_text(compiled_content, encoding="utf-8")
-        return subprocess.CompletedProcess(cmd, returncode=0, stdout="", stderr="")
+        return _FakeCP(returncode=0)
 
     return _run
 
 
-def _run_main(map_path: str | None = None, config: RunConfig | None = None) -> tuple[int, str]:
-    """Run main() with given argv; return (exit_code, stdout). map_path=None => no args."""
-    if config is None:
-        config = RunConfig()
+class _OrjsonStub:
+    """Stand-in for the orjson module that records what loads() was given."""
 
-    argv: list[str] = []
-    if map_path is not None:
-        argv.extend(["--map-file", map_path])
-    if config.extra_args:
-        argv.append(f"--compile-args={config.extra_args}")
-    if config.modified_only:
-        argv.append("--modified-only")
-
-    stdout_capture = io.StringIO()
-    if config.monkeypatch is not None:
-        config.monkeypatch.setattr(sys, "stdout", stdout_capture)
-
-    patch_target = "verify_kfp_compiled.subprocess.run"
-    if config.mock_subprocess_run is not None:
-        with patch(patch_target, config.mock_subprocess_run):
-            code = verify_kfp_compiled.main(argv)
-    else:
-        code = verify_kfp_compiled.main(argv)
-
-    return code, stdout_capture.getvalue()
+    JSONDecodeError = json.JSONDecodeError
 
+    def __init__(self) -> None:
+        self.inputs: list[object] = []
 
-def test_map_not_found_in_process(
-    tmp_path: Path,
-    monkeypatch: pytest.MonkeyPatch,
-) -> None:
-    """In-process: nonexistent map path exits 1 and prints message."""
-    monkeypatch.chdir(tmp_path)
-    code, out = _run_main("no-such-map.json", RunConfig(monkeypatch=monkeypatch))
-    assert code == 1
-    assert "Pipeline map file not found" in out
-    assert "no-such-map.json" in out
-
-
-def test_invalid_json_in_process(
-    tmp_path: Path,
-    monkeypatch: pytest.MonkeyPatch,
-) -> None:
-    """In-process: invalid JSON in map file exits 1."""
-    monkeypatch.chdir(tmp_path)
-    (tmp_path / "map.json").write_text("{ invalid }")
-    code, out = _run_main("map.json", RunConfig(monkeypatch=monkeypatch))
-    assert code == 1
-    assert "Invalid JSON" in out
-
-
-def test_default_argv_in_process(
+    def loads(self, data: bytes) -> object:
+        self.inputs.append(data)
+        if not isinstance(data, bytes):
+            raise TypeError("orjson stub expects bytes")
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError as e:  # orjson reports bad UTF-8 as JSONDecodeError
+            raise json.JSONDecodeError("str is not valid UTF-8", "", 0) from e
+        return json.loads(text)
+
+
+@pytest.mark.parametrize("use_orjson", [True, False], ids=["orjson", "stdlib-json"])
+@pytest.mark.parametrize(
+    ("content", "expected_code", "expected_substring"),
+    [
+        pytest.param(b"{}", 0, "", id="valid"),
+        pytest.param(b"{ invalid }", 1, "Invalid JSON", id="invalid-json"),
+        pytest.param(b'{"p\xff.py": "p.yaml"}', 1, "not valid UTF-8", id="invalid-utf8"),
+    ],
+)
+def test_map_json_parsing(
     tmp_path: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+    use_orjson: bool,
+    content: bytes,
+    expected_code: int,
+    expected_substring: str,
 ) -> None:
-    """In-process: no args uses default map path and exits 1 when not found."""
+    """The map parses the same with orjson (given raw bytes) and with stdlib json."""
     monkeypatch.chdir(tmp_path)
-    code, out = _run_main(map_path=None, config=RunConfig(monkeypatch=monkeypatch))
-    assert code == 1
-    assert ".github/kfp-pipelines-map.json" in out or "not found" in out
+    stub = _OrjsonStub()
+    monkeypatch.setattr(verify_kfp_compiled, "_orjson", stub if use_orjson else None)
+    (tmp_path / "map.json").write_bytes(content)
+    code, out = _run_main("map.json", None, capsys)
+    assert code == expected_code
+    assert expected_substring in out
+    assert stub.inputs == ([content] if use_orjson else [])
 
 
-def test_missing_py_file_in_process(
+def test_unlistable_directory_falls_back_to_stat(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
-    """In-process: mapped .py file missing exits 1 before calling kfp."""
+    """Files missing from the directory scan are still found by a direct stat."""
     monkeypatch.chdir(tmp_path)
-    (tmp_path / "out.yaml").write_text("x: 1\n")
-    map_file = tmp_path / "map.json"
-    map_file.write_text(json.dumps({"missing.py": "out.yaml"}))
-    code, out = _run_main("map.json", RunConfig(monkeypatch=monkeypatch))
-    assert code == 1
-    assert "Python file not found" in out
-    assert "missing.py" in out
+    _make_pipeline_map(tmp_path, pipeline_template)
+    real_scandir = os.scandir
 
+    def _scandir(path: Any = ".") -> Any:
+        if path == ".":
+            raise PermissionError(13, "Permission denied", path)
+        return real_scandir(path)
 
-def test_missing_yaml_file_in_process(
-    tmp_path: Path,
-    monkeypatch: pytest.MonkeyPatch,
-) -> None:
-    """In-process: mapped .yaml file missing exits 1 before calling kfp."""
-    monkeypatch.chdir(tmp_path)
-    (tmp_path / "real.py").write_text("# dummy\n")
-    map_file = tmp_path / "map.json"
-    map_file.write_text(json.dumps({"real.py": "missing.yaml"}))
-    code, out = _run_main("map.json", RunConfig(monkeypatch=monkeypatch))
-    assert code == 1
-    assert "Expected YAML missing" in out
-    assert "missing.yaml" in out
+    monkeypatch.setattr(os, "scandir", _scandir)
+    code, out = _run_main(
+        "map.json",
+        RunConfig(mock_subprocess_run=_RecordingStub(_fake_kfp_run(_DEFAULT_YAML))),
+        capsys,
+    )
+    assert code == 0
+    assert "up to date" in out
 
 
 def test_kfp_compile_failure_exits_nonzero(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
     """When kfp dsl compile fails, script exits 1 and prints stderr."""
     monkeypatch.chdir(tmp_path)
-    _make_pipeline_map(tmp_path)
-
-    mock_run = MagicMock(
-        return_value=subprocess.CompletedProcess(
-            ["kfp", "dsl", "compile"],
-            returncode=1,
-            stdout="",
-            stderr="kfp compile error",
-        )
+    _make_pipeline_map(tmp_path, pipeline_template)
+
+    mock_run = _RecordingStub(
+        lambda _cmd, **_kwargs: _FakeCP(returncode=1, stderr="kfp compile error")
     )
 
     code, out = _run_main(
         "map.json",
-        RunConfig(monkeypatch=monkeypatch, mock_subprocess_run=mock_run),
+        RunConfig(mock_subprocess_run=mock_run),
+        capsys,
     )
     assert code == 1
     assert "kfp dsl compile failed" in out
@@ -271,61 +374,86 @@ def test_kfp_compile_failure_exits_nonzero(
 
 def test_yaml_out_of_date_exits_nonzero(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
     """When compiled YAML differs from saved, script exits 1 with diff and fix command."""
     monkeypatch.chdir(tmp_path)
-    _make_pipeline_map(tmp_path, yaml_content="old: content\n")
+    _make_pipeline_map(tmp_path, pipeline_template, yaml_content="old: content\n")
 
     code, out = _run_main(
         "map.json",
         RunConfig(
-            monkeypatch=monkeypatch,
-            mock_subprocess_run=MagicMock(side_effect=_fake_kfp_run("new: content\n")),
+            mock_subprocess_run=_RecordingStub(_fake_kfp_run("new: content\n")),
         ),
+        capsys,
     )
     assert code == 1
     assert "out of date" in out
-    assert ("old:" in out and "new:" in out) or "---" in out
+    assert "--- p.yaml\n+++ (compiled)\n@@ -1 +1 @@\n-old: content\n+new: content\n" in out
     assert "kfp dsl compile" in out
     assert "p.py" in out and "p.yaml" in out
 
 
 def test_yaml_out_of_date_includes_extra_args_in_fix_command(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
     """Fix command in output includes extra compile args when provided."""
     monkeypatch.chdir(tmp_path)
-    _make_pipeline_map(tmp_path)
+    _make_pipeline_map(tmp_path, pipeline_template)
 
     code, out = _run_main(
         "map.json",
         RunConfig(
             extra_args="--pipeline-root gs://bucket",
-            monkeypatch=monkeypatch,
-            mock_subprocess_run=MagicMock(side_effect=_fake_kfp_run("b: 2\n")),
+            mock_subprocess_run=_RecordingStub(_fake_kfp_run("b: 2\n")),
         ),
+        capsys,
     )
     assert code == 1
-    assert "--pipeline-root gs://bucket" in out or "gs://bucket" in out
+    assert "--output p.yaml --pipeline-root gs://bucket" in out
 
 
 def test_yaml_up_to_date_exits_zero(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
     """When compiled YAML matches saved, script exits 0 and prints up to date."""
     monkeypatch.chdir(tmp_path)
     content = "same: content\n"
-    _make_pipeline_map(tmp_path, yaml_content=content)
+    _make_pipeline_map(tmp_path, pipeline_template, yaml_content=content)
 
     code, out = _run_main(
         "map.json",
         RunConfig(
-            monkeypatch=monkeypatch,
-            mock_subprocess_run=MagicMock(side_effect=_fake_kfp_run(content)),
+            mock_subprocess_run=_RecordingStub(_fake_kfp_run(content)),
         ),
+        capsys,
+    )
+    assert code == 0
+    assert "up to date" in out
+
+
+def test_yaml_with_crlf_newlines_is_up_to_date(
+    tmp_path: Path,
+    pipeline_template: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """Saved YAML that differs from the compiled output only in newlines is up to date."""
+    monkeypatch.chdir(tmp_path)
+    _make_pipeline_map(tmp_path, pipeline_template, yaml_content="a: 1\r\nb: 2\r\n")
+
+    code, out = _run_main(
+        "map.json",
+        RunConfig(mock_subprocess_run=_RecordingStub(_fake_kfp_run("a: 1\nb: 2\n"))),
+        capsys,
     )
     assert code == 0
     assert "up to date" in out
@@ -333,75 +461,241 @@ def test_yaml_up_to_date_exits_zero(
 
 def test_extra_args_passed_to_kfp(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
     """Extra compile args are passed to the kfp subprocess call."""
     monkeypatch.chdir(tmp_path)
-    content = "a: 1\n"
-    _make_pipeline_map(tmp_path, yaml_content=content)
+    content = _DEFAULT_YAML
+    _make_pipeline_map(tmp_path, pipeline_template, yaml_content=content)
 
-    mock_run = MagicMock(side_effect=_fake_kfp_run(content))
+    mock_run = _RecordingStub(_fake_kfp_run(content))
     code, _ = _run_main(
         "map.json",
         RunConfig(
             extra_args="--pipeline-root s3://bucket",
-            monkeypatch=monkeypatch,
             mock_subprocess_run=mock_run,
         ),
+        capsys,
     )
     assert code == 0
-    call_args = mock_run.call_args[0][0]
+    call_args = mock_run.calls[-1][0]
     assert "--pipeline-root" in call_args
     assert "s3://bucket" in call_args
 
 
 def test_compile_args_starting_with_dashes(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
     """--compile-args accepts values that start with dashes (e.g. --some-flag)."""
     monkeypatch.chdir(tmp_path)
-    content = "a: 1\n"
-    _make_pipeline_map(tmp_path, yaml_content=content)
+    content = _DEFAULT_YAML
+    _make_pipeline_map(tmp_path, pipeline_template, yaml_content=content)
 
-    mock_run = MagicMock(side_effect=_fake_kfp_run(content))
+    mock_run = _RecordingStub(_fake_kfp_run(content))
     code, _ = _run_main(
         "map.json",
         RunConfig(
             extra_args="--disable-execution-caching-by-default",
-            monkeypatch=monkeypatch,
             mock_subprocess_run=mock_run,
         ),
+        capsys,
     )
     assert code == 0
-    call_args = mock_run.call_args[0][0]
+    call_args = mock_run.calls[-1][0]
     assert "--disable-execution-caching-by-default" in call_args
 
 
 def test_compile_args_with_dashes_via_equals_syntax(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
 ) -> None:
     """--compile-args=<value> works even when value starts with dashes."""
     monkeypatch.chdir(tmp_path)
-    content = "a: 1\n"
-    _make_pipeline_map(tmp_path, yaml_content=content)
-
-    mock_run = MagicMock(side_effect=_fake_kfp_run(content))
+    content = _DEFAULT_YAML
+    _make_pipeline_map(tmp_path, pipeline_template, yaml_content=content)
 
-    stdout_capture = io.StringIO()
-    monkeypatch.setattr(sys, "stdout", stdout_capture)
+    mock_run = _RecordingStub(_fake_kfp_run(content))
 
-    with patch("verify_kfp_compiled.subprocess.run", mock_run):
-        code = verify_kfp_compiled.main([
+    with patch("verify_kfp_compiled.subprocess.run", mock_run), patch(
+        "verify_kfp_compiled._start_kfp_worker", lambda: None
+    ):
+        code = _vkc_main([
             "--map-file", "map.json",
             "--compile-args=--disable-execution-caching-by-default",
         ])
     assert code == 0
-    call_args = mock_run.call_args[0][0]
+    call_args = mock_run.calls[-1][0]
     assert "--disable-execution-caching-by-default" in call_args
 
 
+def test_multiple_entries_report_first_failure_in_map_order(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """Entries compile concurrently to distinct outputs; output and failure follow map order."""
+    monkeypatch.chdir(tmp_path)
+    entries = {"p1.py": "p1.yaml", "p2.py": "p2.yaml", "p3.py": "p3.yaml"}
+    for py_file, yaml_file in entries.items():
+        (tmp_path / py_file).write_text(_DUMMY_PY)
+        (tmp_path / yaml_file).write_text(_DEFAULT_YAML)
+    (tmp_path / "p2.yaml").write_text("old: content\n")
+    (tmp_path / "map.json").write_text(json.dumps(entries))
+
+    mock_run = _RecordingStub(_fake_kfp_run(_DEFAULT_YAML))
+    code, out = _run_main("map.json", RunConfig(mock_subprocess_run=mock_run), capsys)
+    assert code == 1
+    assert out.index("p1.yaml is up to date") < out.index("p2.yaml is out of date")
+    assert "p3.yaml" not in out
+    output_paths = [cmd[cmd.index("--output") + 1] for cmd, _ in mock_run.calls]
+    assert len(set(output_paths)) == len(output_paths)
+
+
+def test_cache_file_skips_compile_until_files_change(
+    tmp_path: Path,
+    pipeline_template: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """With --cache-file, entries with unchanged content skip kfp; changed files recompile."""
+    monkeypatch.chdir(tmp_path)
+    _make_pipeline_map(tmp_path, pipeline_template)
+    mock_run = _RecordingStub(_fake_kfp_run(_DEFAULT_YAML))
+    config = RunConfig(mock_subprocess_run=mock_run, cache_file="cache.json")
+
+    code, out = _run_main("map.json", config, capsys)
+    assert code == 0
+    assert len(mock_run.calls) == 1
+    assert "p.py -> p.yaml" in json.loads((tmp_path / "cache.json").read_text())
+
+    code, out = _run_main("map.json", config, capsys)
+    assert code == 0
+    assert len(mock_run.calls) == 1
+    assert "up to date (cached)" in out
+
+    # New mtime, same content. p.py is hard-linked from the session template,
+    # so replace the link before touching it.
+    py_file = tmp_path / "p.py"
+    content = py_file.read_bytes()
+    py_file.unlink()
+    py_file.write_bytes(content)
+    os.utime(py_file, ns=(1, 1))
+    code, out = _run_main("map.json", config, capsys)
+    assert code == 0
+    assert len(mock_run.calls) == 1
+    assert "up to date (cached)" in out
+
+    (tmp_path / "p.yaml").unlink()
+    (tmp_path / "p.yaml").write_text("old: content\n")
+    code, out = _run_main("map.json", config, capsys)
+    assert code == 1
+    assert len(mock_run.calls) == 2
+    assert "out of date" in out
+
+
+def test_cache_file_unreadable_yaml_exits_nonzero(
+    tmp_path: Path,
+    pipeline_template: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """With --cache-file, a file that cannot be hashed is reported, not a traceback."""
+    monkeypatch.chdir(tmp_path)
+    _make_pipeline_map(tmp_path, pipeline_template)
+
+    real_sha256 = verify_kfp_compiled._file_sha256
+
+    def _deny_yaml(path: Path | str) -> str:
+        if str(path) == "p.yaml":
+            raise PermissionError(13, "Permission denied", str(path))
+        return real_sha256(path)
+
+    monkeypatch.setattr(verify_kfp_compiled, "_file_sha256", _deny_yaml)
+    mock_run = _RecordingStub(_fake_kfp_run(_DEFAULT_YAML))
+    code, out = _run_main(
+        "map.json", RunConfig(mock_subprocess_run=mock_run, cache_file="cache.json"), capsys
+    )
+    assert code == 1
+    assert "Cannot read YAML file p.yaml" in out
+    assert mock_run.calls == []
+
+
+def _write_fake_kfp(root: Path, log_file: Path) -> Path:
+    """Write a stand-in kfp package whose CLI writes the default YAML and logs each call.
+
+    Each log line holds the CLI args and whether ``cwd_helper`` (a module in
+    the current directory) was importable from the CLI process.
+    """
+    cli_dir = root / "kfp" / "cli"
+    cli_dir.mkdir(parents=True)
+    (root / "kfp" / "__init__.py").write_text("")
+    (cli_dir / "__init__.py").write_text("")
+    (cli_dir / "cli.py").write_text(
+        "import importlib.util\n"
+        "import json\n"
+        "\n"
+        "class _Cli:\n"
+        "    def main(self, args, **_kwargs):\n"
+        "        out = args[args.index('--output') + 1]\n"
+        "        with open(out, 'w', encoding='utf-8') as f:\n"
+        f"            f.write({_DEFAULT_YAML!r})\n"
+        "        cwd_importable = importlib.util.find_spec('cwd_helper') is not None\n"
+        "        entry = {'args': args, 'cwd_importable': cwd_importable}\n"
+        f"        with open({str(log_file)!r}, 'a', encoding='utf-8') as f:\n"
+        "            f.write(json.dumps(entry) + '\\n')\n"
+        "\n"
+        "cli = _Cli()\n"
+    )
+    return root
+
+
+def test_kfp_worker_compiles_without_cli(
+    tmp_path: Path,
+    pipeline_template: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """When kfp is importable, compiles go through a pooled worker, not the kfp CLI."""
+    monkeypatch.chdir(tmp_path)
+    _make_pipeline_map(tmp_path, pipeline_template)
+    log_file = tmp_path / "kfp-calls.jsonl"
+    monkeypatch.setenv("PYTHONPATH", str(_write_fake_kfp(tmp_path / "fake", log_file)))
+
+    mock_run = _RecordingStub(_fake_kfp_run("cli: used\n"))
+    with patch("verify_kfp_compiled.subprocess.run", mock_run):
+        code = _vkc_main([
+            "--map-file", "map.json",
+            "--compile-args=--pipeline-root s3://bucket",
+        ])
+    assert code == 0
+    assert mock_run.calls == []
+    (entry,) = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert entry["args"][:2] == ["dsl", "compile"]
+    assert entry["args"][-2:] == ["--pipeline-root", "s3://bucket"]
+
+
+def test_kfp_worker_does_not_import_from_cwd(
+    tmp_path: Path,
+    pipeline_template: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Like the kfp console script, the worker does not put the cwd on sys.path."""
+    monkeypatch.chdir(tmp_path)
+    _make_pipeline_map(tmp_path, pipeline_template)
+    (tmp_path / "cwd_helper.py").write_text("NAME = 'x'\n")
+    log_file = tmp_path / "kfp-calls.jsonl"
+    monkeypatch.setenv("PYTHONPATH", str(_write_fake_kfp(tmp_path / "fake", log_file)))
+
+    assert _vkc_main(["--map-file", "map.json"]) == 0
+    (entry,) = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert entry["cwd_importable"] is False
+
+
 # ----- Git-modified-only tests -----
 
 
@@ -411,23 +705,23 @@ def _make_dual_mock(
     *,
     git_diff: tuple[int, str] = (0, ""),
     git_fetch: tuple[int, str] = (0, ""),
+    base_ref_exists: bool = False,
 ):
-    """Return a MagicMock that dispatches to git, kfp based on cmd."""
+    """Return a recording stub that dispatches to git, kfp based on cmd.
+
+    *git_diff_output* is NUL-separated, as produced by ``git diff -z``.
+    """
 
     def _dispatch(
         cmd: list[str], **_kwargs: object
-    ) -> subprocess.CompletedProcess:
+    ) -> _FakeCP:
         if len(cmd) >= 2 and cmd[0] == "git":
+            if cmd[1] == "rev-parse":
+                return _FakeCP(returncode=0 if base_ref_exists else 1)
             if cmd[1] == "fetch":
-                return subprocess.CompletedProcess(
-                    cmd,
-                    returncode=git_fetch[0],
-                    stdout="",
-                    stderr=git_fetch[1],
-                )
+                return _FakeCP(returncode=git_fetch[0], stderr=git_fetch[1])
             if cmd[1] == "diff":
-                return subprocess.CompletedProcess(
-                    cmd,
+                return _FakeCP(
                     returncode=git_diff[0],
                     stdout=git_diff_output,
                     stderr=git_diff[1],
@@ -443,21 +737,20 @@ def _make_dual_mock(
             raise AssertionError(msg)
         out_path = Path(cmd[out_idx + 1])
         out_path.write_text(compiled_content, encoding="utf-8")
-        return subprocess.CompletedProcess(
-            cmd, returncode=0, stdout="", stderr=""
-        )
+        return _FakeCP(returncode=0)
 
-    return MagicMock(side_effect=_dispatch)
+    return _RecordingStub(_dispatch)
 
 
 def test_modified_only_filters_entries(
     tmp_path: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
     """With --modified-only, only entries whose files appear in git diff are validated."""
     monkeypatch.chdir(tmp_path)
     monkeypatch.setenv("GITHUB_BASE_REF", "main")
-    content = "a: 1\n"
+    content = _DEFAULT_YAML
     (tmp_path / "p1.py").write_text("# pipeline 1\n")
     (tmp_path / "p1.yaml").write_text(content)
     (tmp_path / "p2.py").write_text("# pipeline 2\n")
@@ -465,15 +758,15 @@ def test_modified_only_filters_entries(
     map_file = tmp_path / "map.json"
     map_file.write_text(json.dumps({"p1.py": "p1.yaml", "p2.py": "p2.yaml"}))
 
-    mock_run = _make_dual_mock(git_diff_output="p1.py\n", compiled_content=content)
+    mock_run = _make_dual_mock(git_diff_output="p1.py\0", compiled_content=content)
 
     code, out = _run_main(
         "map.json",
         RunConfig(
-            monkeypatch=monkeypatch,
             mock_subprocess_run=mock_run,
             modified_only=True,
         ),
+        capsys,
     )
     assert code == 0
     assert "p1.py" in out
@@ -481,231 +774,244 @@ def test_modified_only_filters_entries(
     assert "Validating 1 pipeline map entry" in out
 
 
-def test_modified_only_no_matches_exits_zero(
+@pytest.mark.parametrize(
+    ("git_diff_output", "git_diff", "git_fetch", "expected_code", "expected_substring"),
+    [
+        pytest.param(
+            "unrelated_file.txt\0", (0, ""), (0, ""), 0, "nothing to validate",
+            id="no-matches",
+        ),
+        pytest.param(
+            "p.yaml\0", (0, ""), (0, ""), 0, "up to date",
+            id="yaml-modified",
+        ),
+        pytest.param(
+            "", (128, "fatal: bad revision"), (0, ""), 1, "git diff failed",
+            id="git-diff-failure",
+        ),
+        pytest.param(
+            "", (0, ""), (128, "fatal: could not fetch"), 1, "git fetch failed",
+            id="git-fetch-failure",
+        ),
+    ],
+)
+def test_modified_only_outcomes(
+    git_diff_output: str,
+    git_diff: tuple[int, str],
+    git_fetch: tuple[int, str],
+    expected_code: int,
+    expected_substring: str,
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
-    """With --modified-only and no modified files matching the map, exit 0."""
+    """--modified-only: unmatched diffs skip, .yaml changes validate, git failures exit 1."""
     monkeypatch.chdir(tmp_path)
     monkeypatch.setenv("GITHUB_BASE_REF", "main")
-    (tmp_path / "p.py").write_text("# dummy\n")
-    (tmp_path / "p.yaml").write_text("a: 1\n")
-    map_file = tmp_path / "map.json"
-    map_file.write_text(json.dumps({"p.py": "p.yaml"}))
+    _make_pipeline_map(tmp_path, pipeline_template)
 
     mock_run = _make_dual_mock(
-        git_diff_output="unrelated_file.txt\n", compiled_content="a: 1\n"
+        git_diff_output,
+        _DEFAULT_YAML,
+        git_diff=git_diff,
+        git_fetch=git_fetch,
     )
 
     code, out = _run_main(
         "map.json",
         RunConfig(
-            monkeypatch=monkeypatch,
             mock_subprocess_run=mock_run,
             modified_only=True,
         ),
+        capsys,
     )
-    assert code == 0
-    assert "nothing to validate" in out
-
-
-def test_modified_only_matches_yaml_file(
-    tmp_path: Path,
-    monkeypatch: pytest.MonkeyPatch,
-) -> None:
-    """With --modified-only, modifying the .yaml file also triggers validation."""
-    monkeypatch.chdir(tmp_path)
-    monkeypatch.setenv("GITHUB_BASE_REF", "main")
-    content = "a: 1\n"
-    (tmp_path / "p.py").write_text("# dummy\n")
-    (tmp_path / "p.yaml").write_text(content)
-    map_file = tmp_path / "map.json"
-    map_file.write_text(json.dumps({"p.py": "p.yaml"}))
-
-    mock_run = _make_dual_mock(git_diff_output="p.yaml\n", compiled_content=content)
-
-    code, out = _run_main(
-        "map.json",
-        RunConfig(
-            monkeypatch=monkeypatch,
-            mock_subprocess_run=mock_run,
-            modified_only=True,
-        ),
-    )
-    assert code == 0
-    assert "up to date" in out
+    assert code == expected_code
+    assert expected_substring in out
 
 
 def test_modified_only_reads_github_base_ref(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
     """GITHUB_BASE_REF is normalised to origin/<branch> for fetch and merge-base diff."""
     monkeypatch.chdir(tmp_path)
     monkeypatch.setenv("GITHUB_BASE_REF", "main")
-    content = "a: 1\n"
-    _make_pipeline_map(tmp_path, yaml_content=content)
+    content = _DEFAULT_YAML
+    _make_pipeline_map(tmp_path, pipeline_template, yaml_content=content)
 
-    mock_run = _make_dual_mock(git_diff_output="p.py\n", compiled_content=content)
+    mock_run = _make_dual_mock(git_diff_output="p.py\0", compiled_content=content)
 
     code, _ = _run_main(
         "map.json",
         RunConfig(
-            monkeypatch=monkeypatch,
             mock_subprocess_run=mock_run,
             modified_only=True,
         ),
+        capsys,
     )
     assert code == 0
-    # First git call is fetch, second is diff
-    fetch_cmd = mock_run.call_args_list[0][0][0]
-    assert fetch_cmd == ["git", "fetch", "origin", "main"]
-    diff_cmd = mock_run.call_args_list[1][0][0]
-    assert "origin/main...HEAD" in diff_cmd
+    git_cmds = [cmd for cmd, _ in mock_run.calls if cmd[0] == "git"]
+    assert git_cmds == [
+        ["git", "rev-parse", "--verify", "--quiet", "origin/main^{commit}"],
+        ["git", "fetch", "origin", "main"],
+        ["git", "diff", "--merge-base", "--name-only", "-z", "origin/main", "HEAD"],
+    ]
 
 
-def test_modified_only_without_github_base_ref_fails(
+def test_modified_only_skips_fetch_when_base_ref_exists(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
-    """Without GITHUB_BASE_REF, --modified-only exits 1 with a clear error."""
-    monkeypatch.chdir(tmp_path)
-    monkeypatch.delenv("GITHUB_BASE_REF", raising=False)
-    _make_pipeline_map(tmp_path)
-
-    code, out = _run_main(
-        "map.json",
-        RunConfig(
-            monkeypatch=monkeypatch,
-            modified_only=True,
-        ),
-    )
-    assert code == 1
-    assert "GITHUB_BASE_REF" in out
-    assert "pull_request" in out
-
-
-def test_git_diff_failure_exits_nonzero(
-    tmp_path: Path,
-    monkeypatch: pytest.MonkeyPatch,
-) -> None:
-    """When git diff returns non-zero, exit 1 with error message."""
+    """An already-present base ref is not fetched again; odd file names survive -z."""
     monkeypatch.chdir(tmp_path)
     monkeypatch.setenv("GITHUB_BASE_REF", "main")
-    _make_pipeline_map(tmp_path)
+    _make_pipeline_map(tmp_path, pipeline_template)
 
     mock_run = _make_dual_mock(
-        git_diff_output="",
-        compiled_content="",
-        git_diff=(128, "fatal: bad revision"),
+        git_diff_output="odd\nname.txt\0p.py\0",
+        compiled_content=_DEFAULT_YAML,
+        base_ref_exists=True,
     )
 
     code, out = _run_main(
         "map.json",
-        RunConfig(
-            monkeypatch=monkeypatch,
-            mock_subprocess_run=mock_run,
-            modified_only=True,
-        ),
+        RunConfig(mock_subprocess_run=mock_run, modified_only=True),
+        capsys,
     )
-    assert code == 1
-    assert "git diff failed" in out
+    assert code == 0
+    assert "up to date" in out
+    assert not any(cmd[:2] == ["git", "fetch"] for cmd, _ in mock_run.calls)
 
 
-def test_git_fetch_failure_exits_nonzero(
+def test_modified_only_without_github_base_ref_fails(
     tmp_path: Path,
+    pipeline_template: Path,
     monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
 ) -> None:
-    """When git fetch fails, exit 1 with error message."""
+    """Without GITHUB_BASE_REF, --modified-only exits 1 with a clear error."""
     monkeypatch.chdir(tmp_path)
-    monkeypatch.setenv("GITHUB_BASE_REF", "main")
-    _make_pipeline_map(tmp_path)
-
-    mock_run = _make_dual_mock(
-        git_diff_output="",
-        compiled_content="",
-        git_fetch=(128, "fatal: could not fetch"),
-    )
+    monkeypatch.delenv("GITHUB_BASE_REF", raising=False)
+    _make_pipeline_map(tmp_path, pipeline_template)
 
     code, out = _run_main(
         "map.json",
         RunConfig(
-            monkeypatch=monkeypatch,
-            mock_subprocess_run=mock_run,
             modified_only=True,
         ),
+        capsys,
     )
     assert code == 1
-    assert "git fetch failed" in out
+    assert "GITHUB_BASE_REF" in out
+    assert "pull_request" in out
 
 
 # ----- Optional integration test (real kfp via uv workspace) -----
 
 
-def _uv_run_integration(
-    tmp_path: Path, *cmd: str
-) -> subprocess.CompletedProcess:
-    """Run a command with uv run --package integration-env and cwd=tmp_path.
+@pytest.fixture(scope="session")
+def integration_python() -> str:
+    """Resolve the integration-env interpreter once per session via uv run.
 
-    Uses --project so uv discovers the workspace from repo root while
-    --directory makes the child process run with cwd=tmp_path.
+    Uses --project so uv discovers the workspace from repo root; later
+    commands call the interpreter directly instead of re-resolving the env.
     """
-    return subprocess.run(
+    if _UV is None:
+        pytest.skip("uv not installed")
+    result = subprocess.run(
         [
-            "uv",
+            _UV,
             "run",
             "--project",
             str(REPO_ROOT),
             "--package",
             "integration-env",
-            "--directory",
-            str(tmp_path),
             "--",
-            *cmd,
+            "python",
+            "-c",
+            "import sys; print(sys.executable)",
         ],
         capture_output=True,
         text=True,
         check=False,
         cwd=REPO_ROOT,
     )
+    if result.returncode != 0:
+        pytest.skip(f"integration-env unavailable: {result.stderr}")
+    return result.stdout.strip()
 
 
-@pytest.mark.integration
-def test_real_kfp_compile_up_to_date(tmp_path: Path) -> None:
-    """With kfp from workspace integration-env, compile and verify pass."""
-    # Minimal pipeline with one task (kfp v2 requires at least one task)
-    pipeline_py = tmp_path / "minimal_pipeline.py"
-    pipeline_py.write_text(
-        "from kfp import dsl\n"
-        "\n"
-        "@dsl.component\n"
-        "def hello() -> str:\n"
-        '    return "hi"\n'
-        "\n"
-        "@dsl.pipeline(name='minimal')\n"
-        "def minimal_pipeline() -> str:\n"
-        "    return hello().output\n"
-    )
-    out_yaml = tmp_path / "minimal_pipeline.yaml"
-    result = _uv_run_integration(
-        tmp_path,
-        "kfp",
-        "dsl",
-        "compile",
-        "--py",
-        str(pipeline_py),
-        "--output",
-        str(out_yaml),
+def _run_integration(
+    integration_python: str, tmp_path: Path, *cmd: str
+) -> subprocess.CompletedProcess:
+    """Run a command from the integration-env with cwd=tmp_path.
+
+    The env's bin directory is prepended to PATH so ``kfp`` and ``python``
+    resolve to the integration-env, as they would under ``uv run``.
+    """
+    bin_dir = str(Path(integration_python).parent)
+    env = {**os.environ, "PATH": bin_dir + os.pathsep + os.environ.get("PATH", "")}
+    return subprocess.run(
+        list(cmd),
+        capture_output=True,
+        text=True,
+        check=False,
+        cwd=tmp_path,
+        env=env,
     )
-    if result.returncode != 0:
-        pytest.skip(f"kfp compile failed: {result.stderr}")
-    assert out_yaml.is_file()
+
+
+@pytest.mark.integration
+@pytest.mark.skipif(_UV is None, reason="uv not installed")
+def test_real_kfp_compile_up_to_date(tmp_path: Path, integration_python: str) -> None:
+    """With kfp from workspace integration-env, compile and verify pass.
+
+    Two pipelines share a module name in different directories, so a reused
+    kfp worker must not serve the second one from its module cache.
+    """
+    mapping = {}
+    for subdir in (".", "sub"):
+        (tmp_path / subdir).mkdir(exist_ok=True)
+        # Minimal pipeline with one task (kfp v2 requires at least one task)
+        pipeline_py = tmp_path / subdir / "minimal_pipeline.py"
+        pipeline_py.write_text(
+            "from kfp import dsl\n"
+            "\n"
+            "@dsl.component\n"
+            "def hello() -> str:\n"
+            f'    return "hi from {subdir}"\n'
+            "\n"
+            f"@dsl.pipeline(name='minimal-{len(mapping)}')\n"
+            "def minimal_pipeline() -> str:\n"
+            "    return hello().output\n"
+        )
+        out_yaml = pipeline_py.with_suffix(".yaml")
+        result = _run_integration(
+            integration_python,
+            tmp_path,
+            "kfp",
+            "dsl",
+            "compile",
+            "--py",
+            str(pipeline_py),
+            "--output",
+            str(out_yaml),
+        )
+        if result.returncode != 0:
+            pytest.skip(f"kfp compile failed: {result.stderr}")
+        assert out_yaml.is_file()
+        mapping[f"{subdir}/{pipeline_py.name}"] = f"{subdir}/{out_yaml.name}"
 
     map_file = tmp_path / "map.json"
-    map_file.write_text(json.dumps({pipeline_py.name: out_yaml.name}))
+    map_file.write_text(json.dumps(mapping))
 
-    run_result = _uv_run_integration(
-        tmp_path, "python", str(SCRIPT), "--map-file", "map.json"
+    run_result = _run_integration(
+        integration_python, tmp_path, "python", str(SCRIPT), "--map-file", "map.json"
     )
-    assert run_result.returncode == 0
-    assert "up to date" in run_result.stdout
+    assert run_result.returncode == 0, run_result.stdout
+    assert run_result.stdout.count("up to date") == 2
@@ -6,16 +6,28 @@ Exits with 1 on first mismatch or missing file.
 
 from __future__ import annotations
 
-import argparse
-import difflib
+import contextlib
+import filecmp
+import functools
+import hashlib
+import importlib
+import io
 import json
 import os
+import queue
 import shlex
 import subprocess
 import sys
-import tempfile
+import threading
 from pathlib import Path
-from typing import cast
+from types import SimpleNamespace
+from typing import NoReturn, TextIO, cast
+
+try:
+    # Optional faster JSON parser for large maps; stdlib json is the fallback.
+    _orjson = importlib.import_module("orjson")
+except ImportError:
+    _orjson = None
 
 
 def _read_lines(path: Path | str, error_label: str) -> list[str]:
@@ -27,106 +39,515 @@ def _read_lines(path: Path | str, error_label: str) -> list[str]:
         raise RuntimeError(f"❌ Cannot read {error_label}: {e}") from e
 
 
-def _compile_and_read_outputs(
+# Runs inside a long-lived interpreter so ``import kfp`` is paid once per
+# worker instead of once per map entry. Protocol: one JSON line in (the
+# ``kfp dsl compile`` args), one JSON line out (returncode and stderr).
+_KFP_WORKER_SCRIPT = r"""
+import contextlib
+import io
+import json
+import os
+import site
+import sys
+import sysconfig
+
+# "python -c" puts the current directory first on sys.path; the kfp console
+# script does not, so drop it to resolve imports exactly like the CLI.
+if sys.path and sys.path[0] == "":
+    del sys.path[0]
+
+proto = os.fdopen(os.dup(1), "w", encoding="utf-8")
+os.dup2(2, 1)
+try:
+    from kfp.cli import cli
+except Exception as e:
+    proto.write(json.dumps({"ready": False, "error": str(e)}) + "\n")
+    proto.flush()
+    sys.exit(0)
+
+lib_dirs = {sysconfig.get_paths()[k] for k in ("stdlib", "platstdlib", "purelib", "platlib")}
+with contextlib.suppress(AttributeError):
+    lib_dirs.update(site.getsitepackages())
+with contextlib.suppress(AttributeError):
+    lib_dirs.add(site.getusersitepackages())
+lib_prefixes = tuple(os.path.realpath(d) + os.sep for d in lib_dirs)
+
+
+def is_user_module(module):
+    path = getattr(module, "__file__", None)
+    return bool(path) and not os.path.realpath(path).startswith(lib_prefixes)
+
+
+baseline = set(sys.modules)
+proto.write(json.dumps({"ready": True}) + "\n")
+proto.flush()
+for line in iter(sys.stdin.readline, ""):
+    args = json.loads(line)
+    err = io.StringIO()
+    returncode = 0
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(err):
+        try:
+            cli.cli.main(
+                args=["dsl", "compile", *args],
+                obj={},
+                auto_envvar_prefix="KFP",
+                prog_name="kfp",
+                standalone_mode=False,
+            )
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception as e:
+            if callable(getattr(e, "show", None)):  # click usage errors
+                e.show()
+                returncode = getattr(e, "exit_code", 1)
+            else:
+                print(str(e), file=sys.stderr)
+                returncode = 1
+    # Forget modules imported from the user's tree so the next pipeline file
+    # (possibly with the same module name) is imported fresh.
+    for name in set(sys.modules) - baseline:
+        if is_user_module(sys.modules[name]):
+            del sys.modules[name]
+    proto.write(json.dumps({"returncode": returncode, "stderr": err.getvalue()}) + "\n")
+    proto.flush()
+"""
+
+
+def _start_kfp_worker() -> subprocess.Popen | None:
+    """Start a kfp compile worker; return None when kfp cannot be imported by it."""
+    try:
+        worker = subprocess.Popen(
+            [sys.executable, "-c", _KFP_WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+        )
+    except OSError:
+        return None
+    assert worker.stdout is not None
+    line = worker.stdout.readline()
+    if not line or not json.loads(line).get("ready"):
+        _stop_kfp_worker(worker)
+        return None
+    return worker
+
+
+def _stop_kfp_worker(worker: subprocess.Popen) -> None:
+    """Close the worker's stdin and wait for it to exit, killing it if it hangs."""
+    if worker.stdin is not None:
+        with contextlib.suppress(OSError):
+            worker.stdin.close()
+    try:
+        worker.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        worker.kill()
+        worker.wait()
+
+
+class _KfpWorkerPool:
+    """Reusable kfp compile workers, started on demand and shared across threads.
+
+    ``compile`` returns None when no worker is usable (kfp not importable from
+    this interpreter, or the worker died mid-request); callers then fall back
+    to the ``kfp`` CLI.
+    """
+
+    def __init__(self) -> None:
+        self._idle: queue.SimpleQueue[subprocess.Popen] = queue.SimpleQueue()
+        self._started: list[subprocess.Popen] = []
+        self._lock = threading.Lock()
+        self._available = True
+
+    def _acquire(self) -> subprocess.Popen | None:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        if not self._available:
+            return None
+        worker = _start_kfp_worker()
+        with self._lock:
+            if worker is None:
+                self._available = False
+            else:
+                self._started.append(worker)
+        return worker
+
+    def compile(self, args: list[str]) -> tuple[int, str] | None:
+        """Run ``kfp dsl compile *args`` in a worker; return (returncode, stderr)."""
+        worker = self._acquire()
+        if worker is None:
+            return None
+        assert worker.stdin is not None and worker.stdout is not None
+        try:
+            worker.stdin.write(json.dumps(args) + "\n")
+            worker.stdin.flush()
+            line = worker.stdout.readline()
+            response = json.loads(line) if line else None
+        except (OSError, ValueError):
+            response = None
+        if response is None:
+            worker.kill()
+            return None
+        self._idle.put(worker)
+        return response["returncode"], response["stderr"]
+
+    def close(self) -> None:
+        """Stop every worker started by this pool."""
+        with self._lock:
+            workers, self._started = self._started, []
+        for worker in workers:
+            _stop_kfp_worker(worker)
+
+
+def _compile_only(
     py_file: str,
-    yaml_file: str,
-    compiled_path: Path,
+    compiled_path: str,
     extra_args: list[str],
-) -> tuple[list[str], list[str]]:
-    """Run kfp compile, then read yaml and compiled output."""
-    cmd = [
-        "kfp",
-        "dsl",
-        "compile",
-        "--py",
-        py_file,
-        "--output",
-        str(compiled_path),
-        *extra_args,
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True, check=False)
-    if result.returncode != 0:
+    workers: _KfpWorkerPool | None = None,
+) -> None:
+    """Run kfp compile of py_file into compiled_path, in a pooled worker when possible."""
+    compile_args = ["--py", py_file, "--output", compiled_path, *extra_args]
+    result = workers.compile(compile_args) if workers is not None else None
+    if result is None:
+        cmd = ["kfp", "dsl", "compile", *compile_args]
+        # stdout is never reported, so only stderr is piped back.
+        completed = subprocess.run(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False,
+        )
+        result = completed.returncode, completed.stderr
+    returncode, stderr = result
+    if returncode != 0:
         error_msg = f"❌ kfp dsl compile failed for {py_file}"
-        if result.stderr:
-            error_msg += f"\n{result.stderr}"
+        if stderr:
+            error_msg += f"\n{stderr}"
         raise RuntimeError(error_msg)
 
-    expected = _read_lines(yaml_file, f"YAML file {yaml_file}")
-    actual = _read_lines(compiled_path, "compiled output")
-    return expected, actual
-
 
 def _print_out_of_date_fix_command(
     py_file: str,
     yaml_file: str,
     expected_lines: list[str],
     actual_lines: list[str],
-    compile_args_str: str,
+    quoted_extra: str,
+    out: TextIO,
 ) -> None:
-    """Print diff and the suggested kfp compile command."""
-    print(f"❌ {yaml_file} is out of date with {py_file}")
-    for line in difflib.unified_diff(
-        expected_lines,
-        actual_lines,
-        fromfile=yaml_file,
-        tofile="(compiled)",
-        lineterm="",
-    ):
-        print(line)
-    print("   → update by running:")
-    extra = ""
-    if compile_args_str:
-        extra_parts = shlex.split(compile_args_str)
-        extra = "  ".join(shlex.quote(arg) for arg in extra_parts)
+    """Print diff and the suggested kfp compile command to *out*.
+
+    *quoted_extra* is the shell-quoted extra compile args (see _quote_extra_args).
+    """
+    import difflib  # only needed on mismatch; keeps it off the startup path
+
+    print(f"❌ {yaml_file} is out of date with {py_file}", file=out)
+    # Lines keep their newlines; only a final line without one needs adding.
+    diff = difflib.unified_diff(
+        expected_lines, actual_lines, fromfile=yaml_file, tofile="(compiled)"
+    )
+    out.write("".join(line if line.endswith("\n") else f"{line}\n" for line in diff))
+    print("   → update by running:", file=out)
     cmd_help = (
         f"     kfp dsl compile --py {shlex.quote(py_file)} "
-        f"--output {shlex.quote(yaml_file)}{extra}"
+        f"--output {shlex.quote(yaml_file)}{quoted_extra}"
     )
-    print(cmd_help)
+    print(cmd_help, file=out)
+
+
+def _quote_extra_args(extra_args: list[str]) -> str:
+    """Shell-quote extra compile args as a suffix for the suggested fix command."""
+    return "".join(f" {shlex.quote(arg)}" for arg in extra_args)
 
 
 def _check_one(
     py_file: str,
     yaml_file: str,
-    compiled_path: Path,
+    compiled_path: str,
     extra_args: list[str],
-    compile_args_str: str,
-) -> None:
-    """Compile py_file, diff to yaml_file; raise error on failure."""
-    print(f"→ Checking {py_file} → {yaml_file}")
+    quoted_extra: str,
+    out: TextIO,
+    existing_files: set[str],
+    cache: dict[str, dict] | None = None,
+    workers: _KfpWorkerPool | None = None,
+) -> dict | None:
+    """Compile py_file, diff to yaml_file; raise error on failure.
+
+    Progress and diff output go to *out* so concurrent checks do not interleave.
+    *existing_files* is the result of _scan_existing_files for the map.
+    When *cache* is given and holds a matching record for this entry, the
+    compile is skipped. Returns the entry's cache record on success.
+    """
+    print(f"→ Checking {py_file} → {yaml_file}", file=out)
 
-    if not Path(py_file).is_file():
+    if not _is_existing_file(py_file, existing_files):
         raise RuntimeError(f"❌ Python file not found: {py_file}")
-    if not Path(yaml_file).is_file():
+    if not _is_existing_file(yaml_file, existing_files):
         raise RuntimeError(f"❌ Expected YAML missing: {yaml_file}")
 
-    expected_lines, actual_lines = _compile_and_read_outputs(
-        py_file, yaml_file, compiled_path, extra_args
-    )
+    record = None
+    if cache is not None:
+        cached = cache.get(_cache_key(py_file, yaml_file))
+        record = _cache_record(py_file, yaml_file, quoted_extra, cached)
+        if _cache_hit(cached, record):
+            print(f"✅ {yaml_file} is up to date (cached)", file=out)
+            return record
+
+    _compile_only(py_file, compiled_path, extra_args, workers)
+
+    # Byte-identical files are the common case and need no decoding; otherwise
+    # compare text lines (which also normalises newlines) and build the diff.
+    # With a cache the saved YAML is already hashed, so hash the output too.
+    try:
+        if record is not None:
+            identical = _file_sha256(compiled_path) == record["yaml"][2]
+        else:
+            identical = filecmp.cmp(yaml_file, compiled_path, shallow=False)
+    except OSError:
+        identical = False  # _read_lines below reports which file is unreadable
+    if not identical:
+        expected_lines = _read_lines(yaml_file, f"YAML file {yaml_file}")
+        actual_lines = _read_lines(compiled_path, "compiled output")
+        if expected_lines != actual_lines:
+            _print_out_of_date_fix_command(
+                py_file,
+                yaml_file,
+                expected_lines,
+                actual_lines,
+                quoted_extra,
+                out,
+            )
+            raise RuntimeError(f"❌ {yaml_file} is out of date with {py_file}")
+
+    print(f"✅ {yaml_file} is up to date", file=out)
+    return record
 
-    if expected_lines != actual_lines:
-        _print_out_of_date_fix_command(
-            py_file,
-            yaml_file,
-            expected_lines,
-            actual_lines,
-            compile_args_str,
-        )
-        raise RuntimeError(f"❌ {yaml_file} is out of date with {py_file}")
 
-    print(f"✅ {yaml_file} is up to date")
+def _scan_existing_files(paths: list[str]) -> set[str]:
+    """Return the subset of *paths* found as files by listing their directories.
+
+    Each parent directory is listed once with os.scandir instead of stat-ing
+    every path, which is cheaper for large maps and on network filesystems.
+    Only positive hits are reliable; see _is_existing_file.
+    """
+    by_dir: dict[str, list[str]] = {}
+    for path in paths:
+        by_dir.setdefault(os.path.dirname(path), []).append(path)
+    existing: set[str] = set()
+    for directory, dir_paths in by_dir.items():
+        try:
+            with os.scandir(directory or ".") as entries:
+                names = {entry.name for entry in entries if entry.is_file()}
+        except OSError:
+            continue
+        existing.update(path for path in dir_paths if os.path.basename(path) in names)
+    return existing
+
+
+def _is_existing_file(path: str, scanned: set[str]) -> bool:
+    """Return True when *path* is a file, trusting *scanned* only for hits.
+
+    A miss falls back to os.path.isfile: names that differ only in case on a
+    case-insensitive filesystem, or directories that can be searched but not
+    listed, are absent from the scan yet still exist.
+    """
+    return path in scanned or os.path.isfile(path)
+
+
+def _check_all(
+    mapping: dict[str, str],
+    tmp_dir: str,
+    extra_args: list[str],
+    quoted_extra: str,
+    out: TextIO,
+    cache: dict[str, dict] | None = None,
+) -> None:
+    """Run _check_one for every entry concurrently; raise the first failure in map order.
+
+    Each kfp compile runs in a separate process (a pooled worker or the kfp
+    CLI), so entries are checked on a thread pool, each writing to its own
+    compiled path and output buffer. Buffers are written to *out* in map order; once
+    an entry fails, checks that have not started yet are cancelled. Records
+    of entries that passed are stored in *cache*.
+    """
+    if not mapping:
+        return
+    # Deferred: concurrent.futures pulls in logging, which error paths and
+    # empty maps never need.
+    from concurrent.futures import ThreadPoolExecutor
+
+    existing_files = _scan_existing_files([*mapping, *mapping.values()])
+    max_workers = min(len(mapping), os.cpu_count() or 1)
+    workers = _KfpWorkerPool()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            jobs = []
+            for i, (py_file, yaml_file) in enumerate(mapping.items()):
+                buf = io.StringIO()
+                future = executor.submit(
+                    _check_one,
+                    py_file,
+                    yaml_file,
+                    os.path.join(tmp_dir, f"tmp_{i}.yaml"),
+                    extra_args,
+                    quoted_extra,
+                    buf,
+                    existing_files,
+                    cache,
+                    workers,
+                )
+                jobs.append((_cache_key(py_file, yaml_file), future, buf))
+            try:
+                for key, future, buf in jobs:
+                    try:
+                        record = future.result()
+                    finally:
+                        out.write(buf.getvalue())
+                    if cache is not None and record is not None:
+                        cache[key] = record
+            except BaseException:
+                for _, future, _ in jobs:
+                    future.cancel()
+                raise
+    finally:
+        workers.close()
+
+
+def _cache_key(py_file: str, yaml_file: str) -> str:
+    """Return the cache key for a py -> yaml map entry."""
+    return f"{py_file} -> {yaml_file}"
+
+
+@functools.cache
+def _kfp_version() -> str | None:
+    """Return the installed kfp version, or None when it is not importable here."""
+    import importlib.metadata  # slow to import; only the cache needs it
+
+    try:
+        return importlib.metadata.version("kfp")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def _file_sha256(path: Path | str) -> str:
+    """Return the hex SHA-256 of a file without reading it into Python objects."""
+    with open(path, "rb") as f:
+        file_digest = getattr(hashlib, "file_digest", None)  # Python 3.11+
+        if file_digest is not None:
+            return file_digest(f, "sha256").hexdigest()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+def _file_fingerprint(path: str, error_label: str, cached: object = None) -> list:
+    """Return [mtime_ns, size, sha256] for path; raise error on failure.
+
+    The digest from *cached* is reused when mtime and size still match, so
+    unchanged files are not hashed again.
+    """
+    try:
+        st = os.stat(path)
+        if (
+            isinstance(cached, list)
+            and len(cached) == 3
+            and cached[:2] == [st.st_mtime_ns, st.st_size]
+        ):
+            return cached
+        return [st.st_mtime_ns, st.st_size, _file_sha256(path)]
+    except OSError as e:
+        raise RuntimeError(f"❌ Cannot read {error_label}: {e}") from e
+
+
+def _cache_record(
+    py_file: str, yaml_file: str, quoted_extra: str, cached: object = None
+) -> dict:
+    """Build the cache record for an entry from file fingerprints and compile settings.
+
+    *cached* is the entry's previous record, if any, whose digests are reused
+    for files whose mtime and size are unchanged.
+    """
+    cached = cached if isinstance(cached, dict) else {}
+    return {
+        "py": _file_fingerprint(py_file, f"Python file {py_file}", cached.get("py")),
+        "yaml": _file_fingerprint(
+            yaml_file, f"YAML file {yaml_file}", cached.get("yaml")
+        ),
+        "compile_args": quoted_extra,
+        "kfp": _kfp_version(),
+    }
+
+
+def _cache_hit(cached: object, record: dict) -> bool:
+    """Return True when *cached* verified the same file contents and settings.
+
+    Only digests are compared, so a fresh checkout with new mtimes still hits.
+    """
+    if not isinstance(cached, dict):
+        return False
+    return all(
+        isinstance(cached.get(name), list) and cached[name][-1:] == record[name][-1:]
+        for name in ("py", "yaml")
+    ) and all(cached.get(name) == record[name] for name in ("compile_args", "kfp"))
+
+
+def _load_cache(cache_file: str) -> dict[str, dict]:
+    """Load the cache file; a missing or unreadable cache is treated as empty."""
+    try:
+        with open(cache_file, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _save_cache(cache_file: str, cache: dict[str, dict]) -> None:
+    """Atomically rewrite the cache file; failures only print a warning."""
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"⚠️ Cannot write cache file {cache_file}: {e}")
+
+
+def _compile_tmp_root() -> str | None:
+    """Return /dev/shm for compiled outputs when usable, else None (the default temp dir).
+
+    Compiled YAML is written and read back once per entry; keeping it on tmpfs
+    avoids disk writeback. An explicit TMPDIR is always respected.
+    """
+    if os.environ.get("TMPDIR"):
+        return None
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return None
 
 
 def _load_json_map(map_path: Path, map_file: str) -> object:
     """Load JSON from map_path; raise error on failure."""
     try:
-        with open(map_path, encoding="utf-8") as f:
-            return json.load(f)
+        data = map_path.read_bytes()
+        if _orjson is not None:
+            try:
+                return _orjson.loads(data)
+            except json.JSONDecodeError:
+                data.decode("utf-8")  # report invalid UTF-8 as such, not as bad JSON
+                raise
+        return json.loads(data.decode("utf-8"))
+    except (FileNotFoundError, IsADirectoryError) as e:
+        raise RuntimeError(f"❌ Pipeline map file not found: {map_file}") from e
     except OSError as e:
         raise RuntimeError(f"❌ Cannot read map file {map_file}: {e}") from e
     except UnicodeDecodeError as e:
         raise RuntimeError(f"❌ Map file {map_file} is not valid UTF-8: {e}") from e
-    except json.JSONDecodeError as e:
+    except json.JSONDecodeError as e:  # orjson.JSONDecodeError subclasses it
         raise RuntimeError(f"❌ Invalid JSON in {map_file}: {e}") from e
 
 
@@ -137,48 +558,102 @@ def _validate_mapping_entries(mapping: object) -> None:
             f"❌ Pipeline map must be a JSON object (py -> yaml), "
             f"got {type(mapping).__name__}"
         )
-    for py_file, yaml_file in mapping.items():
-        if not isinstance(py_file, str) or not isinstance(yaml_file, str):
-            bad = "key" if not isinstance(py_file, str) else "value"
-            raise TypeError(
-                f"❌ Pipeline map entries must be strings (py -> yaml), "
-                f"got non-string {bad}"
-            )
+    if all(isinstance(k, str) and isinstance(v, str) for k, v in mapping.items()):
+        return
+    bad = next(
+        "key" if not isinstance(k, str) else "value"
+        for k, v in mapping.items()
+        if not (isinstance(k, str) and isinstance(v, str))
+    )
+    raise TypeError(
+        f"❌ Pipeline map entries must be strings (py -> yaml), got non-string {bad}"
+    )
 
 
 def _load_and_validate_mapping(map_file: str) -> dict:
     """Load JSON map and validate; raise error on failure."""
-    map_path = Path(map_file)
-    if not map_path.is_file():
-        raise RuntimeError(f"❌ Pipeline map file not found: {map_file}")
-
-    mapping = _load_json_map(map_path, map_file)
+    mapping = _load_json_map(Path(map_file), map_file)
     _validate_mapping_entries(mapping)
 
     return cast(dict, mapping)
 
 
-def _parse_args(argv: list[str] | None = None) -> argparse.Namespace:
-    """Parse command-line arguments."""
-    parser = argparse.ArgumentParser(
-        description="Validate that KFP .py files are compiled to their .yaml counterparts.",
-    )
-    parser.add_argument(
-        "--map-file",
-        default=".github/kfp-pipelines-map.json",
-        help="Path to JSON mapping file (py -> yaml)",
-    )
-    parser.add_argument(
-        "--compile-args",
-        default="",
-        help="Extra arguments to pass to kfp dsl compile",
-    )
-    parser.add_argument(
-        "--modified-only",
-        action="store_true",
-        help="Only validate entries whose files are Git-modified",
+_USAGE = (
+    "usage: verify_kfp_compiled.py [-h] [--map-file MAP_FILE] "
+    "[--compile-args COMPILE_ARGS] [--modified-only] [--cache-file CACHE_FILE]"
+)
+
+_HELP = f"""{_USAGE}
+
+Validate that KFP .py files are compiled to their .yaml counterparts.
+
+options:
+  -h, --help            show this help message and exit
+  --map-file MAP_FILE   Path to JSON mapping file (py -> yaml)
+  --compile-args COMPILE_ARGS
+                        Extra arguments to pass to kfp dsl compile
+  --modified-only       Only validate entries whose files are Git-modified
+  --cache-file CACHE_FILE
+                        Path to a JSON cache of entries verified up to date;
+                        entries whose .py and .yaml are unchanged since then
+                        skip kfp compile (off by default)"""
+
+# Options that take a value, mapped to their attribute on the parsed args.
+_VALUE_OPTIONS = {
+    "--map-file": "map_file",
+    "--compile-args": "compile_args",
+    "--cache-file": "cache_file",
+}
+
+
+def _is_option(token: str) -> bool:
+    """Return True when *token* names one of this script's options."""
+    name = token.partition("=")[0]
+    return name in _VALUE_OPTIONS or name in ("--modified-only", "-h", "--help")
+
+
+def _usage_error(message: str) -> NoReturn:
+    """Print usage and *message* to stderr and exit 2, like argparse."""
+    print(f"{_USAGE}\nverify_kfp_compiled.py: error: {message}", file=sys.stderr)
+    raise SystemExit(2)
+
+
+def _parse_args(argv: list[str] | None = None) -> SimpleNamespace:
+    """Parse command-line arguments.
+
+    Hand-rolled rather than argparse, whose import dominates startup for a
+    handful of options. Accepts ``--opt value`` and ``--opt=value``; the
+    ``=`` form also allows values that start with dashes.
+    """
+    args = SimpleNamespace(
+        map_file=".github/kfp-pipelines-map.json",
+        compile_args="",
+        modified_only=False,
+        cache_file="",
     )
-    return parser.parse_args(argv)
+    tokens = sys.argv[1:] if argv is None else argv
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+        name, has_value, value = token.partition("=")
+        if token in ("-h", "--help"):
+            print(_HELP)
+            raise SystemExit(0)
+        if token == "--modified-only":
+            args.modified_only = True
+        elif name in _VALUE_OPTIONS:
+            if not has_value:
+                # Like argparse, a following option is not taken as the value;
+                # use --opt=value for values that look like options.
+                if i == len(tokens) or _is_option(tokens[i]):
+                    _usage_error(f"argument {name}: expected one argument")
+                value = tokens[i]
+                i += 1
+            setattr(args, _VALUE_OPTIONS[name], value)
+        else:
+            _usage_error(f"unrecognized arguments: {token}")
+    return args
 
 
 def _normalize_base_branch(base_branch: str) -> str:
@@ -209,15 +684,29 @@ def _resolve_base_branch() -> str:
     return ref
 
 
+def _ref_exists(ref: str) -> bool:
+    """Return True when *ref* already resolves to a commit in the local repository."""
+    cmd = ["git", "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+    except FileNotFoundError as e:
+        raise RuntimeError("❌ git is not installed or not on PATH") from e
+    return result.returncode == 0
+
+
 def _fetch_base_branch(base_branch: str) -> None:
     """Fetch the base branch so it is available for git diff.
 
     *base_branch* must already be remote-qualified (e.g. ``origin/main``).
+    The fetch is skipped when the ref is already present locally, e.g. after
+    a checkout with ``fetch-depth: 0``.
     """
     if "/" not in base_branch:
         raise RuntimeError(
             f"❌ base_branch must be remote-qualified (e.g. 'origin/main'), got: {base_branch!r}"
         )
+    if _ref_exists(base_branch):
+        return
     remote, branch = base_branch.split("/", 1)
     cmd = ["git", "fetch", remote, branch]
     try:
@@ -236,10 +725,14 @@ def _fetch_base_branch(base_branch: str) -> None:
 
 
 def _get_git_modified_files(base_branch: str) -> set[str]:
-    """Return the set of file paths modified between *base_branch* and HEAD."""
+    """Return the set of file paths modified between *base_branch* and HEAD.
+
+    Paths are read NUL-separated (``-z``) so names containing newlines or
+    non-ASCII characters are returned verbatim rather than quoted.
+    """
     normalized = _normalize_base_branch(base_branch)
     _fetch_base_branch(normalized)
-    cmd = ["git", "diff", "--name-only", f"{normalized}...HEAD"]
+    cmd = ["git", "diff", "--merge-base", "--name-only", "-z", normalized, "HEAD"]
     try:
         result = subprocess.run(
             cmd, capture_output=True, text=True, check=False
@@ -253,7 +746,7 @@ def _get_git_modified_files(base_branch: str) -> set[str]:
         if result.stderr:
             error_msg += f"\n{result.stderr}"
         raise RuntimeError(error_msg)
-    return {line for line in result.stdout.splitlines() if line}
+    return {path for path in result.stdout.split("\0") if path}
 
 
 def _filter_mapping_by_modified_files(
@@ -271,8 +764,12 @@ def main(argv: list[str] | None = None) -> int:
     """Validate each py→yaml pair from the map file; return 1 on first failure, 0 on success."""
     args = _parse_args(argv)
     map_file = args.map_file
-    compile_args_str = args.compile_args
-    extra_args = shlex.split(compile_args_str) if compile_args_str else []
+    extra_args = shlex.split(args.compile_args) if args.compile_args else []
+    quoted_extra = _quote_extra_args(extra_args)
+    cache = _load_cache(args.cache_file) if args.cache_file else None
+    # Show progress live on a terminal; otherwise (CI logs, pipes) collect the
+    # whole report and write it once.
+    out: TextIO = sys.stdout if sys.stdout.isatty() else io.StringIO()
 
     try:
         mapping = _load_and_validate_mapping(map_file)
@@ -282,20 +779,32 @@ def main(argv: list[str] | None = None) -> int:
             modified_files = _get_git_modified_files(base_branch)
             mapping = _filter_mapping_by_modified_files(mapping, modified_files)
             if not mapping:
-                print("ℹ️ No modified files match the pipeline map; nothing to validate.")
+                print(
+                    "ℹ️ No modified files match the pipeline map; nothing to validate.",
+                    file=out,
+                )
                 return 0
             entry_word = "entry" if len(mapping) == 1 else "entries"
-            print(f"ℹ️ Validating {len(mapping)} pipeline map {entry_word} (modified only).")
+            print(
+                f"ℹ️ Validating {len(mapping)} pipeline map {entry_word} (modified only).",
+                file=out,
+            )
+
+        if mapping:
+            import tempfile  # deferred: error paths and empty maps exit without it
 
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            compiled = Path(tmp_dir) / "tmp.yaml"
-            for py_file, yaml_file in mapping.items():
-                _check_one(py_file, yaml_file, compiled, extra_args, compile_args_str)
+            with tempfile.TemporaryDirectory(dir=_compile_tmp_root()) as tmp_dir:
+                _check_all(mapping, tmp_dir, extra_args, quoted_extra, out, cache)
 
         return 0
     except (RuntimeError, TypeError) as e:
-        print(e)
+        print(e, file=out)
         return 1
+    finally:
+        if isinstance(out, io.StringIO):
+            sys.stdout.write(out.getvalue())
+        if cache is not None:
+            _save_cache(args.cache_file, cache)
 
 
 if __name__ == "__main__":